@@ -1,7 +1,11 @@
 """CPU functionality."""
 
+import re
+import struct
 import sys
 
+from cpu_jit import HAS_NUMBA, run_jit
+
 # instruction codes
 HLT = 0b00000001    # halt
 LDI = 0b10000010    # sets a specified register to a value
@@ -23,21 +27,72 @@ OOI = 0b00000111    # prevent out of index
 LIM = 0b11111111    # limit values
 
 
+
+class _Halt(BaseException):
+    """Raised by the HLT handler to unwind out of the run loop."""
+
+
+# one reusable instance so halting never allocates
+_HALT = _Halt()
+
+
 class CPU:
     """Main CPU class."""
 
+    # fixed attribute slots: each attribute access becomes a C-level
+    # slot load instead of an instance-dict lookup
+    __slots__ = ('ram', 'reg', 'pc', 'sp_val', 'running', 'flag',
+                 '_alu', '_write', 'branchtable', '_ramv', '_unpack')
+
     def __init__(self):
         """Construct a new CPU."""
-        # ram holds 256 bytes of memory
-        self.ram = [0] * 256
-        # holding 8 general-purpose registers
-        self.reg = [0] * 8
+        # ram holds 256 bytes of memory, stored as raw bytes
+        # (plus 2 pad bytes so the 3-byte fetch never runs off the end)
+        self.ram = bytearray(256 + 2)
+        # zero-copy view of ram plus a precompiled 3-byte unpacker,
+        # so an instruction fetch is one C call and no slice copy
+        self._ramv = memoryview(self.ram)
+        self._unpack = struct.Struct('BBB').unpack_from
+        # holding 8 general-purpose registers, also raw bytes
+        self.reg = bytearray(8)
         # program counter (pc)
         self.pc = 0
-        # stack pointer (sp)
-        self.sp = 7
+        # stack pointer, kept as a plain byte (at the LS-8 init value)
+        # instead of indirecting through reg[7] on every stack op
+        self.sp_val = 0xF4
         # CPU running
         self.running = True
+        # cached stdout write; skips print()'s per-call argument
+        # handling and flush overhead on every PRN
+        self._write = sys.stdout.write
+        # ALU dispatch table, keyed by opcode so dispatch is one
+        # int-keyed dict lookup instead of a chain of string compares
+        self._alu = {
+            ADD: self._add,
+            SUB: self._sub,
+            MUL: self._mul,
+            INC: self._inc,
+            DEC: self._dec,
+            CMP: self._cmp
+        }
+        # create branchtable: one entry per possible opcode, indexed
+        # by the raw instruction byte so dispatch is a single list
+        # index instead of a dict hash + probe
+        self.branchtable = [self._illegal] * 256
+        self.branchtable[HLT] = self.halt
+        self.branchtable[LDI] = self.ldi
+        self.branchtable[PRN] = self.print
+        self.branchtable[ADD] = self.add
+        self.branchtable[SUB] = self.subtract
+        self.branchtable[MUL] = self.multiply
+        self.branchtable[PUSH] = self.push
+        self.branchtable[POP] = self.pop
+        self.branchtable[CALL] = self.call
+        self.branchtable[RET] = self._return
+        self.branchtable[CMP] = self.compare
+        self.branchtable[JEQ] = self.jump_if_equal
+        self.branchtable[JNE] = self.jump_if_not_equal
+        self.branchtable[JMP] = self.jump
 
     def ram_read(self, address):
         # return the ram at the specified, indexed address
@@ -51,64 +106,124 @@ class CPU:
     def load(self, filename=None):
         """Load a program into memory."""
 
-        address = 0
-
         # if cpu not being fed 2 files (file_to_run, file_to_load)
         if len(sys.argv) != 2:
             print("Usage: cpu.py loaded_program_name.ls8")
 
-        # open the file
+        # read the whole file at once
         try:    # catch FileNotFound errors
             with open(filename, 'r') as f:
-                for line in f:
-                    # only take code to the left of any comments
-                    line = line.split("#")[0].strip()
-                    # Skip past empty lines and commented lines
-                    if line == '' or line[0][0] == '#':
-                        continue
-                    # Since we're working in binary, have to set base to 2
-                    try:
-                        self.ram[address] = int(line, 2)
-                    # Raise error if not fed appropriate int
-                    except ValueError:
-                        print(f'Invalid number: {line}')
-                        sys.exit(1)
-                    address += 1
+                text = f.read()
         except FileNotFoundError:
             print(f"Could not find file: {sys.argv[1]}")
             sys.exit(1)
 
+        # grab the 8-bit code at the start of every line in one scan;
+        # blank lines and comment lines simply don't match
+        codes = re.findall(r'^\s*([01]{8})', text, re.M)
+        program = bytes(int(code, 2) for code in codes)
+        self.ram[:len(program)] = program
+
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
 
-        reg_a = reg_a & OOI
-        reg_b = reg_b & OOI
-        if op == "ADD":
-            self.reg[reg_a] += self.reg[reg_b]
-        elif op == "SUB":
-            self.reg[reg_a] -= self.reg[reg_b]
-        elif op == "MUL":
-            self.reg[reg_a] *= self.reg[reg_b]
-        elif op == "INC":  # INC
-            self.reg[reg_a] += 1
-            self.reg[reg_a] = self.reg[reg_a] & LIM
-        elif op == "DEC":   # DEC
-            self.reg[reg_a] -= 1
-            self.reg[reg_a] = self.reg[reg_a] & LIM
-        elif op == "CMP":
-            if self.reg[reg_a] == self.reg[reg_b]:
-                self.flag = HLT
-            elif self.reg[reg_a] < self.reg[reg_b]:
-                self.flag = 0b00000100
-            elif self.reg[reg_a] > self.reg[reg_b]:
-                self.flag = 0b00000010
-        else:
+        handler = self._alu.get(op)
+        if handler is None:
             raise Exception("Unsupported ALU operation")
+        handler(reg_a, reg_b)
+
+    def _add(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] + self.reg[reg_b]) & LIM
+
+    def _sub(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] - self.reg[reg_b]) & LIM
+
+    def _mul(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] * self.reg[reg_b]) & LIM
+
+    def _inc(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] + 1) & LIM
+
+    def _dec(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] - 1) & LIM
+
+    def _cmp(self, reg_a, reg_b):
+        # set the FL bits per the LS-8 spec (E=bit0, G=bit1, L=bit2)
+        # branchlessly; bools are ints so each test lands in its bit
+        a = self.reg[reg_a]
+        b = self.reg[reg_b]
+        self.flag = (a == b) | ((a > b) << 1) | ((a < b) << 2)
+
+    def ldi(self, operand_a, operand_b):
+        # operands come straight out of ram, so the value is already
+        # 0-255; only the register index needs clamping
+        self.reg[operand_a & OOI] = operand_b
+
+    def print(self, operand_a, operand_b=None):
+        self._write(f"{self.reg[operand_a]}\n")
+
+    def halt(self, operand_a=None, operand_b=None):
+        self.running = False
+        raise _HALT
 
-    def ldi(self, reg, val):
-        reg = reg & OOI  # bitwise AND to prevent out-of-index
-        val = val & LIM  # bitwise AND to limit values
-        self.reg[reg] = val
+    def add(self, operand_a, operand_b):
+        self.alu(ADD, operand_a, operand_b)
+
+    def subtract(self, operand_a, operand_b):
+        self.alu(SUB, operand_a, operand_b)
+
+    def multiply(self, operand_a, operand_b):
+        self.alu(MUL, operand_a, operand_b)
+
+    def compare(self, operand_a, operand_b):
+        self.alu(CMP, operand_a, operand_b)
+
+    def jump(self, operand_a, operand_b=None):
+        self.pc = self.reg[operand_a]
+
+    def jump_if_equal(self, operand_a, operand_b=None):
+        # test the E bit rather than comparing the whole flag byte
+        if self.flag & 1:
+            self.pc = self.reg[operand_a]
+        else:
+            self.pc += 2
+
+    def jump_if_not_equal(self, operand_a, operand_b=None):
+        if not (self.flag & 1):
+            self.pc = self.reg[operand_a]
+        else:
+            self.pc += 2
+
+    def push(self, operand_a, operand_b=None):
+        # decrement the stack pointer and store the value directly
+        self.sp_val = (self.sp_val - 1) & LIM
+        self.ram[self.sp_val] = self.reg[operand_a & OOI]
+
+    def pop(self, operand_a, operand_b=None):
+        # take the value stored at the top of the stack directly
+        self.reg[operand_a & OOI] = self.ram[self.sp_val]
+        # increment the stack pointer
+        self.sp_val = (self.sp_val + 1) & LIM
+
+    def call(self, operand_a, operand_b=None):
+        # push the address of the instruction after it onto the stack
+        self.sp_val = (self.sp_val - 1) & LIM
+        self.ram[self.sp_val] = (self.pc + 2) & LIM
+        # move the program counter to the subroutine address
+        self.pc = self.reg[operand_a & OOI]
+
+    def _return(self, operand_a=None, operand_b=None):
+        # pop the addr off the stack and store it in the prog counter
+        self.pc = self.ram[self.sp_val]
+        # increment the stack pointer
+        self.sp_val = (self.sp_val + 1) & LIM
+
+    def _illegal(self, operand_a=None, operand_b=None):
+        # default branchtable entry for opcodes the LS-8 doesn't have;
+        # report the byte and stop rather than running off into data
+        print(f"Instruction not valid: {self.ram[self.pc]:08b}")
+        self.running = False
+        raise _HALT
 
     def trace(self):
         """
@@ -116,90 +231,43 @@ class CPU:
         from run() if you need help debugging.
         """
 
-        print(f"TRACE: %02X | %02X %02X %02X |" % (
-            self.pc,
-            # self.fl,
-            # self.ie,
-            self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
-        ), end='')
-
-        for i in range(8):
-            print(" %02X" % self.reg[i], end='')
-
-        print()
+        # build the whole line up front so there's a single write to
+        # stdout instead of one per register
+        print(f"TRACE: {self.pc:02X} | "
+              f"{self.ram[self.pc]:02X} "
+              f"{self.ram[self.pc + 1]:02X} "
+              f"{self.ram[self.pc + 2]:02X} | "
+              + " ".join(f"{r:02X}" for r in self.reg))
 
     def run(self):
         """Run the CPU."""
-        while self.running:
-            # self.trace()
-
-            # instruction register
-            IR = self.ram_read(self.pc)
-
-            # in case the instructions need them
-            operand_a = self.ram_read(self.pc + 1)
-            operand_b = self.ram_read(self.pc + 2)
-
-            # perform the actions needed for instruction per the LS-8 spec
-            if IR == HLT:     # HALT
-                self.running = False
-            elif IR == LDI:   # LOAD IMMEDIATE
-                self.reg[operand_a] = operand_b
-                self.pc += 3
-            elif IR == PRN:   # PRINT
-                print(self.reg[operand_a])
-                self.pc += 2
-            elif IR == ADD:   # ADD
-                self.alu("ADD", operand_a, operand_b)
-                self.pc += 3
-            elif IR == SUB:   # SUBTRACT
-                self.alu("SUB", operand_a, operand_b)
-                self.pc += 3
-            elif IR == MUL:   # MULTIPLY
-                self.alu("MUL", operand_a, operand_b)
-                self.pc += 3
-            elif IR == CMP:
-                self.alu("CMP", operand_a, operand_b)
-                self.pc += 3
-            elif IR == JMP:
-                self.pc = self.reg[operand_a]
-            elif IR == JEQ:
-                if self.flag == HLT:
-                    self.pc = self.reg[operand_a]
-                else:
-                    self.pc += 2
-            elif IR == JNE:
-                if self.flag != HLT:
-                    self.pc = self.reg[operand_a]
-                else:
-                    self.pc += 2
-            elif IR == PUSH:
-                # decrement the stack pointer
-                self.reg[self.sp] -= 1
-                # store the value at that address
-                self.ram_write(self.reg[operand_a], self.reg[self.sp])
-                # increment the program counter
-                self.pc += 2
-            elif IR == POP:
-                # take the value that is stored at the top of the stack
-                self.reg[operand_a] = self.ram_read(self.reg[self.sp])
-                # increment the stack pointer
-                self.reg[self.sp] += 1
-                # increment the program counter
-                self.pc += 2
-            elif IR == CALL:
-                # decrement the stack pointer
-                self.reg[self.sp] -= 1
-                # push the address of the instruction after it onto the stack
-                self.ram_write(self.pc + 2, self.reg[self.sp])
-                # move the program counter to the subroutine address
-                self.pc = self.reg[operand_a]
-            elif IR == RET:
-                # pop the addr off the stack and store it in the prog counter
-                self.pc = self.ram_read(self.reg[self.sp])
-                # increment the stack pointer
-                self.reg[self.sp] += 1
-            else:
-                print("Instruction not valid")
+        # hand the whole fetch/decode/execute loop to the jitted
+        # version when numba is installed
+        if HAS_NUMBA:
+            run_jit(self)
+            return
+        # bind the hot attributes to locals so each loop iteration
+        # does LOAD_FAST lookups instead of attribute lookups
+        ramv = self._ramv
+        unpack = self._unpack
+        branchtable = self.branchtable
+        # the HLT handler raises _Halt to end the program, so the loop
+        # skips the per-instruction check of a running flag
+        try:
+            while True:
+                # self.trace()
+
+                # fetch the instruction register and both operands (in
+                # case the instruction needs them) in one zero-copy
+                # unpack from the ram view
+                IR, operand_a, operand_b = unpack(ramv, self.pc)
+
+                branchtable[IR](operand_a, operand_b)
+
+                # instructions that don't set the PC themselves (bit 4
+                # of the opcode is clear) advance by operand count + 1,
+                # which the spec encodes in the opcode's top two bits
+                if not IR & 0b00010000:
+                    self.pc += ((IR >> 6) & 0b11) + 1
+        except _Halt:
+            return
@@ -0,0 +1,179 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Cython port of the LS-8 CPU.
+
+Build with `python setup.py build_ext --inplace`; the compiled module
+shadows cpu.py, which stays as the pure-Python fallback. The dense
+if/elif on the instruction byte compiles to a C switch, so dispatch is
+native instead of interpreted.
+"""
+
+import re
+import sys
+
+# instruction codes (kept in sync with cpu.py / cpu_additions.py)
+DEF HLT = 0b00000001    # halt
+DEF LDI = 0b10000010    # sets a specified register to a value
+DEF PRN = 0b01000111    # print
+DEF ADD = 0b10100000    # add
+DEF SUB = 0b10100001    # subtract
+DEF MUL = 0b10100010    # multiply
+DEF INC = 0b01100101    # increment
+DEF DEC = 0b01100110    # decrement
+DEF PUSH = 0b01000101   # push onto stack
+DEF POP = 0b01000110    # pop off the stack
+DEF CALL = 0b01010000   # call
+DEF RET = 0b00010001    # return
+DEF CMP = 0b10100111    # compare
+DEF JMP = 0b01010100    # jump
+DEF JEQ = 0b01010101    # equal
+DEF JNE = 0b01010110    # not equal
+
+
+cdef class CPU:
+    """Main CPU class."""
+
+    # ram holds 256 bytes of memory as raw C bytes (plus 2 pad bytes
+    # so a 3-byte fetch never runs off the end)
+    cdef unsigned char ram[258]
+    # 8 general-purpose registers
+    cdef unsigned char reg[8]
+    cdef int pc
+    cdef int sp
+    cdef int running
+    cdef int flag
+
+    def __cinit__(self):
+        cdef int i
+        for i in range(258):
+            self.ram[i] = 0
+        for i in range(8):
+            self.reg[i] = 0
+        self.pc = 0
+        self.sp = 7
+        self.running = True
+        self.flag = 0
+
+    def ram_read(self, address):
+        # return the ram at the specified, indexed address
+        return self.ram[address & 0xFF]
+
+    def ram_write(self, value, address):
+        # set the ram at the specified, indexed address, as the value
+        self.ram[address & 0xFF] = value & 0xFF
+
+    def load(self, filename=None):
+        """Load a program into memory."""
+
+        # if cpu not being fed 2 files (file_to_run, file_to_load)
+        if len(sys.argv) != 2:
+            print("Usage: cpu.py loaded_program_name.ls8")
+
+        # read the whole file at once
+        try:    # catch FileNotFound errors
+            with open(filename, 'r') as f:
+                text = f.read()
+        except FileNotFoundError:
+            print(f"Could not find file: {sys.argv[1]}")
+            sys.exit(1)
+
+        # grab the 8-bit code at the start of every line in one scan;
+        # blank lines and comment lines simply don't match
+        codes = re.findall(r'^\s*([01]{8})', text, re.M)
+        cdef int address = 0
+        for code in codes:
+            self.ram[address] = int(code, 2) & 0xFF
+            address += 1
+
+    def trace(self):
+        """
+        Handy function to print out the CPU state. You might want to call this
+        from run() if you need help debugging.
+        """
+
+        print(f"TRACE: {self.pc:02X} | "
+              f"{self.ram[self.pc]:02X} "
+              f"{self.ram[self.pc + 1]:02X} "
+              f"{self.ram[self.pc + 2]:02X} | "
+              + " ".join(f"{self.reg[i]:02X}" for i in range(8)))
+
+    cpdef run(self):
+        """Run the CPU."""
+        cdef unsigned char IR, operand_a, operand_b, a, b
+        cdef int pc = self.pc
+        cdef int flag = self.flag
+
+        while True:
+            # fetch the instruction register and both operands
+            IR = self.ram[pc]
+            operand_a = self.ram[pc + 1]
+            operand_b = self.ram[pc + 2]
+
+            # dense integer dispatch; Cython lowers this chain to a
+            # C switch on IR
+            if IR == HLT:
+                break
+            elif IR == LDI:
+                self.reg[operand_a & 7] = operand_b
+                pc += 3
+            elif IR == PRN:
+                print(self.reg[operand_a & 7])
+                pc += 2
+            elif IR == ADD:
+                a = operand_a & 7
+                self.reg[a] = (self.reg[a] + self.reg[operand_b & 7]) & 0xFF
+                pc += 3
+            elif IR == SUB:
+                a = operand_a & 7
+                self.reg[a] = (self.reg[a] - self.reg[operand_b & 7]) & 0xFF
+                pc += 3
+            elif IR == MUL:
+                a = operand_a & 7
+                self.reg[a] = (self.reg[a] * self.reg[operand_b & 7]) & 0xFF
+                pc += 3
+            elif IR == INC:
+                a = operand_a & 7
+                self.reg[a] = (self.reg[a] + 1) & 0xFF
+                pc += 3
+            elif IR == DEC:
+                a = operand_a & 7
+                self.reg[a] = (self.reg[a] - 1) & 0xFF
+                pc += 3
+            elif IR == CMP:
+                a = self.reg[operand_a & 7]
+                b = self.reg[operand_b & 7]
+                flag = (a == b) | ((a > b) << 1) | ((a < b) << 2)
+                pc += 3
+            elif IR == JMP:
+                pc = self.reg[operand_a & 7]
+            elif IR == JEQ:
+                if flag & 1:
+                    pc = self.reg[operand_a & 7]
+                else:
+                    pc += 2
+            elif IR == JNE:
+                if not (flag & 1):
+                    pc = self.reg[operand_a & 7]
+                else:
+                    pc += 2
+            elif IR == PUSH:
+                self.reg[7] = (self.reg[7] - 1) & 0xFF
+                self.ram[self.reg[7]] = self.reg[operand_a & 7]
+                pc += 2
+            elif IR == POP:
+                self.reg[operand_a & 7] = self.ram[self.reg[7]]
+                self.reg[7] = (self.reg[7] + 1) & 0xFF
+                pc += 2
+            elif IR == CALL:
+                self.reg[7] = (self.reg[7] - 1) & 0xFF
+                self.ram[self.reg[7]] = (pc + 2) & 0xFF
+                pc = self.reg[operand_a & 7]
+            elif IR == RET:
+                pc = self.ram[self.reg[7]]
+                self.reg[7] = (self.reg[7] + 1) & 0xFF
+            else:
+                print(f"Instruction not valid: {IR:08b}")
+                break
+
+        self.pc = pc
+        self.flag = flag
+        self.running = False
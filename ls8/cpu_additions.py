@@ -1,7 +1,11 @@
 """CPU functionality."""
 
+import re
+import struct
 import sys
 
+from cpu_jit import HAS_NUMBA, run_jit
+
 # instruction codes
 HLT = 0b00000001    # halt
 LDI = 0b10000010    # sets a specified register to a value
@@ -22,39 +26,83 @@ JNE = 0b01010110    # not equal
 OOI = 0b00000111    # prevent out of index
 LIM = 0b11111111    # limit values
 
+# synthetic super-instructions produced by load()'s fusion pass; both
+# have bit 4 set so run() leaves the PC to the handler
+LDI_LDI = 0b11011000    # fused LDI + LDI
+LDI_PRN = 0b11011001    # fused LDI + PRN
+
+
+
+class _Halt(BaseException):
+    """Raised by the HLT handler to unwind out of the run loop."""
+
+
+# one reusable instance so halting never allocates
+_HALT = _Halt()
+
 
 class CPU:
     """Main CPU class."""
 
+    # fixed attribute slots: each attribute access becomes a C-level
+    # slot load instead of an instance-dict lookup
+    __slots__ = ('ram', 'reg', 'pc', 'sp_val', 'running', 'flag',
+                 '_alu', '_write', 'branchtable', '_ramv', '_unpack', '_fused')
+
     def __init__(self):
         """Construct a new CPU."""
-        # ram holds 256 bytes of memory
-        self.ram = [0] * 256
-        # holding 8 general-purpose registers
-        self.reg = [0] * 8
+        # ram holds 256 bytes of memory, stored as raw bytes
+        # (plus 2 pad bytes so the 3-byte fetch never runs off the end)
+        self.ram = bytearray(256 + 2)
+        # zero-copy view of ram plus a precompiled 3-byte unpacker,
+        # so an instruction fetch is one C call and no slice copy
+        self._ramv = memoryview(self.ram)
+        self._unpack = struct.Struct('BBB').unpack_from
+        # holding 8 general-purpose registers, also raw bytes
+        self.reg = bytearray(8)
         # program counter (pc)
         self.pc = 0
-        # stack pointer (sp)
-        self.sp = 7
+        # stack pointer, kept as a plain byte (at the LS-8 init value)
+        # instead of indirecting through reg[7] on every stack op
+        self.sp_val = 0xF4
         # CPU running
         self.running = True
-        # create branchtable
-        self.branchtable = {
-            HLT: self.halt,
-            LDI: self.ldi,
-            PRN: self.print,
-            ADD: self.add,
-            SUB: self.subtract,
-            MUL: self.multiply,
-            PUSH: self.push,
-            POP: self.pop,
-            CALL: self.call,
-            RET: self._return,
-            CMP: self.compare,
-            JEQ: self.jump_if_equal,
-            JNE: self.jump_if_not_equal,
-            JMP: self.jump
+        # cached stdout write; skips print()'s per-call argument
+        # handling and flush overhead on every PRN
+        self._write = sys.stdout.write
+        # ALU dispatch table, keyed by opcode so dispatch is one
+        # int-keyed dict lookup instead of a chain of string compares
+        self._alu = {
+            ADD: self._add,
+            SUB: self._sub,
+            MUL: self._mul,
+            INC: self._inc,
+            DEC: self._dec,
+            CMP: self._cmp
         }
+        # create branchtable: one entry per possible opcode, indexed
+        # by the raw instruction byte so dispatch is a single list
+        # index instead of a dict hash + probe
+        self.branchtable = [self._illegal] * 256
+        self.branchtable[HLT] = self.halt
+        self.branchtable[LDI] = self.ldi
+        self.branchtable[PRN] = self.print
+        self.branchtable[ADD] = self.add
+        self.branchtable[SUB] = self.subtract
+        self.branchtable[MUL] = self.multiply
+        self.branchtable[PUSH] = self.push
+        self.branchtable[POP] = self.pop
+        self.branchtable[CALL] = self.call
+        self.branchtable[RET] = self._return
+        self.branchtable[CMP] = self.compare
+        self.branchtable[JEQ] = self.jump_if_equal
+        self.branchtable[JNE] = self.jump_if_not_equal
+        self.branchtable[JMP] = self.jump
+        self.branchtable[LDI_LDI] = self.ldi_ldi
+        self.branchtable[LDI_PRN] = self.ldi_prn
+        # addresses rewritten by fusion, mapped back to the original
+        # opcode so trace() still dumps the program as written
+        self._fused = {}
 
     def ram_read(self, address):
         # return the ram at the specified, indexed address
@@ -68,135 +116,162 @@ class CPU:
     def load(self, filename=None):
         """Load a program into memory."""
 
-        address = 0
-
         # if cpu not being fed 2 files (file_to_run, file_to_load)
         if len(sys.argv) != 2:
             print("Usage: cpu.py loaded_program_name.ls8")
 
-        # open the file
+        # read the whole file at once
         try:    # catch FileNotFound errors
             with open(filename, 'r') as f:
-                for line in f:
-                    # only take code to the left of any comments
-                    line = line.split("#")[0].strip()
-                    # Skip past empty lines and commented lines
-                    if line == '' or line[0][0] == '#':
-                        continue
-                    # Since we're working in binary, have to set base to 2
-                    try:
-                        self.ram[address] = int(line, 2)
-                    # Raise error if not fed appropriate int
-                    except ValueError:
-                        print(f'Invalid number: {line}')
-                        sys.exit(1)
-                    address += 1
+                text = f.read()
         except FileNotFoundError:
             print(f"Could not find file: {sys.argv[1]}")
             sys.exit(1)
 
+        # grab the 8-bit code at the start of every line in one scan;
+        # blank lines and comment lines simply don't match
+        codes = re.findall(r'^\s*([01]{8})', text, re.M)
+        program = bytes(int(code, 2) for code in codes)
+        self.ram[:len(program)] = program
+        self.fuse(len(program))
+
+    def fuse(self, end):
+        """Fuse common back-to-back pairs into super-instructions.
+
+        Only the leading opcode byte of a pair is rewritten, so a jump
+        into the middle of a fused pair still lands on the original
+        second instruction and runs it normally.
+        """
+
+        pos = 0
+        while pos < end:
+            op = self.ram[pos]
+            size = ((op >> 6) & 0b11) + 1
+            if op == LDI:
+                nxt = self.ram[pos + 3] if pos + 3 < end else 0
+                if nxt == LDI and pos + 6 <= end:
+                    self.ram[pos] = LDI_LDI
+                    self._fused[pos] = LDI
+                    size += 3
+                elif nxt == PRN and pos + 5 <= end:
+                    self.ram[pos] = LDI_PRN
+                    self._fused[pos] = LDI
+                    size += 2
+            pos += size
+
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
 
-        reg_a = reg_a & OOI
-        reg_b = reg_b & OOI
-        if op == "ADD":
-            self.reg[reg_a] += self.reg[reg_b]
-        elif op == "SUB":
-            self.reg[reg_a] -= self.reg[reg_b]
-        elif op == "MUL":
-            self.reg[reg_a] *= self.reg[reg_b]
-        elif op == "INC":  # INC
-            self.reg[reg_a] += 1
-            self.reg[reg_a] = self.reg[reg_a] & LIM
-        elif op == "DEC":   # DEC
-            self.reg[reg_a] -= 1
-            self.reg[reg_a] = self.reg[reg_a] & LIM
-        elif op == "CMP":
-            if self.reg[reg_a] == self.reg[reg_b]:
-                self.flag = HLT
-            elif self.reg[reg_a] < self.reg[reg_b]:
-                self.flag = 0b00000100
-            elif self.reg[reg_a] > self.reg[reg_b]:
-                self.flag = 0b00000010
-        else:
+        handler = self._alu.get(op)
+        if handler is None:
             raise Exception("Unsupported ALU operation")
+        handler(reg_a, reg_b)
+
+    def _add(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] + self.reg[reg_b]) & LIM
+
+    def _sub(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] - self.reg[reg_b]) & LIM
+
+    def _mul(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] * self.reg[reg_b]) & LIM
+
+    def _inc(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] + 1) & LIM
+
+    def _dec(self, reg_a, reg_b):
+        self.reg[reg_a] = (self.reg[reg_a] - 1) & LIM
+
+    def _cmp(self, reg_a, reg_b):
+        # set the FL bits per the LS-8 spec (E=bit0, G=bit1, L=bit2)
+        # branchlessly; bools are ints so each test lands in its bit
+        a = self.reg[reg_a]
+        b = self.reg[reg_b]
+        self.flag = (a == b) | ((a > b) << 1) | ((a < b) << 2)
 
     def ldi(self, operand_a, operand_b):
-        operand_a = operand_a & OOI  # bitwise AND to prevent out-of-index
-        operand_b = operand_b & LIM  # bitwise AND to limit values
-        # IR = self.ram_read(self.pc)
-        self.reg[operand_a] = operand_b
-        # self.reg[operand_a] = operand_b
-        self.pc += 3
+        # operands come straight out of ram, so the value is already
+        # 0-255; only the register index needs clamping
+        self.reg[operand_a & OOI] = operand_b
 
     def print(self, operand_a, operand_b=None):
-        print(self.reg[operand_a])
-        self.pc += 2
+        self._write(f"{self.reg[operand_a]}\n")
 
     def halt(self, operand_a=None, operand_b=None):
         self.running = False
+        raise _HALT
 
     def add(self, operand_a, operand_b):
-        self.alu("ADD", operand_a, operand_b)
-        self.pc += 3
+        self.alu(ADD, operand_a, operand_b)
 
     def subtract(self, operand_a, operand_b):
-        self.alu("SUB", operand_a, operand_b)
-        self.pc += 3
+        self.alu(SUB, operand_a, operand_b)
 
     def multiply(self, operand_a, operand_b):
-        self.alu("MUL", operand_a, operand_b)
-        self.pc += 3
+        self.alu(MUL, operand_a, operand_b)
 
     def compare(self, operand_a, operand_b):
-        self.alu("CMP", operand_a, operand_b)
-        self.pc += 3
+        self.alu(CMP, operand_a, operand_b)
 
     def jump(self, operand_a, operand_b=None):
         self.pc = self.reg[operand_a]
 
     def jump_if_equal(self, operand_a, operand_b=None):
-        if self.flag == HLT:
+        # test the E bit rather than comparing the whole flag byte
+        if self.flag & 1:
             self.pc = self.reg[operand_a]
         else:
             self.pc += 2
 
     def jump_if_not_equal(self, operand_a, operand_b=None):
-        if self.flag != HLT:
+        if not (self.flag & 1):
             self.pc = self.reg[operand_a]
         else:
             self.pc += 2
 
     def push(self, operand_a, operand_b=None):
-        # decrement the stack pointer
-        self.reg[self.sp] -= 1
-        # store the value at that address
-        self.ram_write(self.reg[operand_a], self.reg[self.sp])
-        # increment the program counter
-        self.pc += 2
+        # decrement the stack pointer and store the value directly
+        self.sp_val = (self.sp_val - 1) & LIM
+        self.ram[self.sp_val] = self.reg[operand_a & OOI]
 
     def pop(self, operand_a, operand_b=None):
-        # take the value that is stored at the top of the stack
-        self.reg[operand_a] = self.ram_read(self.reg[self.sp])
+        # take the value stored at the top of the stack directly
+        self.reg[operand_a & OOI] = self.ram[self.sp_val]
         # increment the stack pointer
-        self.reg[self.sp] += 1
-        # increment the program counter
-        self.pc += 2
+        self.sp_val = (self.sp_val + 1) & LIM
 
     def call(self, operand_a, operand_b=None):
-        # decrement the stack pointer
-        self.reg[self.sp] -= 1
         # push the address of the instruction after it onto the stack
-        self.ram_write(self.pc + 2, self.reg[self.sp])
+        self.sp_val = (self.sp_val - 1) & LIM
+        self.ram[self.sp_val] = (self.pc + 2) & LIM
         # move the program counter to the subroutine address
-        self.pc = self.reg[operand_a]
+        self.pc = self.reg[operand_a & OOI]
 
     def _return(self, operand_a=None, operand_b=None):
         # pop the addr off the stack and store it in the prog counter
-        self.pc = self.ram_read(self.reg[self.sp])
+        self.pc = self.ram[self.sp_val]
         # increment the stack pointer
-        self.reg[self.sp] += 1
+        self.sp_val = (self.sp_val + 1) & LIM
+
+    def ldi_ldi(self, operand_a, operand_b):
+        # fused LDI + LDI: the second pair's operands sit right after
+        # the (untouched) second opcode byte
+        self.reg[operand_a & OOI] = operand_b
+        self.reg[self.ram[self.pc + 4] & OOI] = self.ram[self.pc + 5]
+        self.pc += 6
+
+    def ldi_prn(self, operand_a, operand_b):
+        # fused LDI + PRN
+        self.reg[operand_a & OOI] = operand_b
+        self._write(f"{self.reg[self.ram[self.pc + 4] & OOI]}\n")
+        self.pc += 5
+
+    def _illegal(self, operand_a=None, operand_b=None):
+        # default branchtable entry for opcodes the LS-8 doesn't have;
+        # report the byte and stop rather than running off into data
+        print(f"Instruction not valid: {self.ram[self.pc]:08b}")
+        self.running = False
+        raise _HALT
 
     def trace(self):
         """
@@ -204,30 +279,180 @@ class CPU:
         from run() if you need help debugging.
         """
 
-        print(f"TRACE: %02X | %02X %02X %02X |" % (
-            self.pc,
-            # self.fl,
-            # self.ie,
-            self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
-        ), end='')
+        # build the whole line up front so there's a single write to
+        # stdout instead of one per register
+        # show the original opcode for addresses rewritten by fusion
+        op = self._fused.get(self.pc, self.ram[self.pc])
+        print(f"TRACE: {self.pc:02X} | "
+              f"{op:02X} "
+              f"{self.ram[self.pc + 1]:02X} "
+              f"{self.ram[self.pc + 2]:02X} | "
+              + " ".join(f"{r:02X}" for r in self.reg))
+
+    def jit_program(self):
+        """Compile the loaded program to straight-line Python and run it.
+
+        Walks ram from address 0 and emits one Python statement per
+        instruction, so nothing is fetched or decoded at runtime.
+        Python has no goto, so control flow becomes a while True over
+        `if pc == target:` blocks -- but blocks only exist at addresses
+        a jump can actually land on (LDI constants and CALL return
+        addresses), which is a much smaller set than every opcode.
+        """
 
-        for i in range(8):
-            print(" %02X" % self.reg[i], end='')
+        # decode the program into {address: (op, a, b, next_address)},
+        # expanding fused pairs back into their two original
+        # instructions so the middle of a pair is a decoded address
+        instrs = {}
+        pos = 0
+        while pos < 256:
+            op = self.ram[pos]
+            if op == LDI_LDI:
+                instrs[pos] = (LDI, self.ram[pos + 1],
+                               self.ram[pos + 2], pos + 3)
+                instrs[pos + 3] = (LDI, self.ram[pos + 4],
+                                   self.ram[pos + 5], pos + 6)
+                pos += 6
+            elif op == LDI_PRN:
+                instrs[pos] = (LDI, self.ram[pos + 1],
+                               self.ram[pos + 2], pos + 3)
+                instrs[pos + 3] = (PRN, self.ram[pos + 4], 0, pos + 5)
+                pos += 5
+            elif op in self._jit_stmts or op in (JMP, JEQ, JNE,
+                                                 CALL, RET, HLT):
+                size = ((op >> 6) & 0b11) + 1
+                instrs[pos] = (op, self.ram[pos + 1],
+                               self.ram[pos + 2], pos + size)
+                pos += size
+            else:
+                # first byte that isn't a known opcode ends the walk
+                break
+
+        # every LDI constant and CALL return address is a potential
+        # jump target; only those that name real instructions become
+        # dispatch blocks
+        targets = {0}
+        for op, a, b, nxt in instrs.values():
+            if op == LDI:
+                targets.add(b)
+            elif op == CALL:
+                targets.add(nxt)
+        blocks = sorted(t for t in targets if t in instrs)
+
+        lines = [
+            "def _program(reg, ram, write):",
+            "    pc = 0",
+            "    flag = 0",
+            "    sp = 0xF4",
+            "    while True:",
+        ]
+        for start in blocks:
+            lines.append(f"        if pc == {start}:")
+            addr = start
+            while True:
+                if addr not in instrs:
+                    # ran off the decoded program
+                    lines.append("            return")
+                    break
+                if addr != start and addr in targets:
+                    # fell into another block; re-dispatch there
+                    lines.append(f"            pc = {addr}")
+                    lines.append("            continue")
+                    break
+                op, a, b, nxt = instrs[addr]
+                for stmt in self._jit_emit(op, a, b, nxt):
+                    lines.append("            " + stmt)
+                if op in (HLT, JMP, CALL, RET):
+                    break
+                addr = nxt
+        lines.append("        raise RuntimeError("
+                     "f\"jit_program: jumped to address {pc}, "
+                     "which was not compiled\")")
+
+        source = "\n".join(lines) + "\n"
+        namespace = {}
+        exec(compile(source, "<ls8-jit>", "exec"), namespace)
+        namespace["_program"](self.reg, self.ram, self._write)
+        self.running = False
 
-        print()
+    # statement templates for the straight-line ops, keyed by opcode;
+    # {a}/{b} are the operand register indexes, {bv} the raw value
+    _jit_stmts = {
+        LDI: ["reg[{a}] = {bv}  # LDI R{a},{bv}"],
+        PRN: ["write(str(reg[{a}]) + '\\n')  # PRN R{a}"],
+        ADD: ["reg[{a}] = (reg[{a}] + reg[{b}]) & 0xFF  # ADD R{a},R{b}"],
+        SUB: ["reg[{a}] = (reg[{a}] - reg[{b}]) & 0xFF  # SUB R{a},R{b}"],
+        MUL: ["reg[{a}] = (reg[{a}] * reg[{b}]) & 0xFF  # MUL R{a},R{b}"],
+        INC: ["reg[{a}] = (reg[{a}] + 1) & 0xFF  # INC R{a}"],
+        DEC: ["reg[{a}] = (reg[{a}] - 1) & 0xFF  # DEC R{a}"],
+        CMP: ["flag = ((reg[{a}] == reg[{b}])"
+              " | ((reg[{a}] > reg[{b}]) << 1)"
+              " | ((reg[{a}] < reg[{b}]) << 2))  # CMP R{a},R{b}"],
+        PUSH: ["sp = (sp - 1) & 0xFF  # PUSH R{a}",
+               "ram[sp] = reg[{a}]"],
+        POP: ["reg[{a}] = ram[sp]  # POP R{a}",
+              "sp = (sp + 1) & 0xFF"],
+    }
+
+    def _jit_emit(self, op, a, b, nxt):
+        """Render one instruction as Python statements."""
+
+        if op in self._jit_stmts:
+            return [stmt.format(a=a & OOI, b=b & OOI, bv=b)
+                    for stmt in self._jit_stmts[op]]
+        if op == HLT:
+            return ["return  # HLT"]
+        if op == JMP:
+            return [f"pc = reg[{a & OOI}]  # JMP R{a & OOI}",
+                    "continue"]
+        if op == JEQ:
+            return [f"if flag & 1:  # JEQ R{a & OOI}",
+                    f"    pc = reg[{a & OOI}]",
+                    "    continue"]
+        if op == JNE:
+            return [f"if not (flag & 1):  # JNE R{a & OOI}",
+                    f"    pc = reg[{a & OOI}]",
+                    "    continue"]
+        if op == CALL:
+            return ["sp = (sp - 1) & 0xFF  # CALL R" + str(a & OOI),
+                    f"ram[sp] = {nxt}",
+                    f"pc = reg[{a & OOI}]",
+                    "continue"]
+        if op == RET:
+            return ["pc = ram[sp]  # RET",
+                    "sp = (sp + 1) & 0xFF",
+                    "continue"]
+        raise Exception("Unsupported jit instruction")
 
     def run(self):
         """Run the CPU."""
-        while self.running:
-            # self.trace()
-
-            # instruction register
-            IR = self.ram_read(self.pc)
-
-            # in case the instructions need them
-            operand_a = self.ram_read(self.pc + 1)
-            operand_b = self.ram_read(self.pc + 2)
-
-            self.branchtable[IR](operand_a, operand_b)
+        # hand the whole fetch/decode/execute loop to the jitted
+        # version when numba is installed
+        if HAS_NUMBA:
+            run_jit(self)
+            return
+        # bind the hot attributes to locals so each loop iteration
+        # does LOAD_FAST lookups instead of attribute lookups
+        ramv = self._ramv
+        unpack = self._unpack
+        branchtable = self.branchtable
+        # the HLT handler raises _Halt to end the program, so the loop
+        # skips the per-instruction check of a running flag
+        try:
+            while True:
+                # self.trace()
+
+                # fetch the instruction register and both operands (in
+                # case the instruction needs them) in one zero-copy
+                # unpack from the ram view
+                IR, operand_a, operand_b = unpack(ramv, self.pc)
+
+                branchtable[IR](operand_a, operand_b)
+
+                # instructions that don't set the PC themselves (bit 4
+                # of the opcode is clear) advance by operand count + 1,
+                # which the spec encodes in the opcode's top two bits
+                if not IR & 0b00010000:
+                    self.pc += ((IR >> 6) & 0b11) + 1
+        except _Halt:
+            return
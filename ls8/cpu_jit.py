@@ -0,0 +1,145 @@
+"""Numba-jitted LS-8 dispatch loop.
+
+Numba is optional: when it (and numpy) are installed, `HAS_NUMBA` is
+True and `run_jit` holds a nopython-compiled version of the fetch/
+decode/execute loop. The CPU classes fall back to their interpreted
+`run` loop when it is missing.
+"""
+
+# instruction codes (kept in sync with cpu.py / cpu_additions.py)
+HLT = 0b00000001    # halt
+LDI = 0b10000010    # sets a specified register to a value
+PRN = 0b01000111    # print
+ADD = 0b10100000    # add
+SUB = 0b10100001    # subtract
+MUL = 0b10100010    # multiply
+INC = 0b01100101    # increment
+DEC = 0b01100110    # decrement
+PUSH = 0b01000101   # push onto stack
+POP = 0b01000110    # pop off the stack
+CALL = 0b01010000   # call
+RET = 0b00010001    # return
+CMP = 0b10100111    # compare
+JMP = 0b01010100    # jump
+JEQ = 0b01010101    # equal
+JNE = 0b01010110    # not equal
+OOI = 0b00000111    # prevent out of index
+LIM = 0b11111111    # limit values
+LDI_LDI = 0b11011000    # fused LDI + LDI
+LDI_PRN = 0b11011001    # fused LDI + PRN
+
+try:
+    import numpy as np
+    from numba import njit, objmode
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    run_jit = None
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _run(ram, reg, pc):
+        # flag register and stack pointer live in locals while the
+        # loop runs; sp starts at the LS-8 init value
+        flag = 0
+        sp = 0xF4
+        while True:
+            # fetch the instruction and both operand bytes
+            IR = ram[pc]
+            operand_a = ram[(pc + 1) & LIM]
+            operand_b = ram[(pc + 2) & LIM]
+
+            # decode/execute; dicts of callables are unsupported in
+            # nopython mode, so dispatch is an if/elif on the opcode
+            if IR == HLT:
+                return pc
+            elif IR == LDI:
+                reg[operand_a & OOI] = operand_b
+                pc += 3
+            elif IR == LDI_LDI:
+                reg[operand_a & OOI] = operand_b
+                reg[ram[(pc + 4) & LIM] & OOI] = ram[(pc + 5) & LIM]
+                pc += 6
+            elif IR == LDI_PRN:
+                reg[operand_a & OOI] = operand_b
+                val = reg[ram[(pc + 4) & LIM] & OOI]
+                with objmode():
+                    print(val)
+                pc += 5
+            elif IR == PRN:
+                val = reg[operand_a & OOI]
+                with objmode():
+                    print(val)
+                pc += 2
+            elif IR == ADD:
+                a = operand_a & OOI
+                reg[a] = (reg[a] + reg[operand_b & OOI]) & LIM
+                pc += 3
+            elif IR == SUB:
+                a = operand_a & OOI
+                reg[a] = (reg[a] - reg[operand_b & OOI]) & LIM
+                pc += 3
+            elif IR == MUL:
+                a = operand_a & OOI
+                reg[a] = (reg[a] * reg[operand_b & OOI]) & LIM
+                pc += 3
+            elif IR == INC:
+                a = operand_a & OOI
+                reg[a] = (reg[a] + 1) & LIM
+                pc += 3
+            elif IR == DEC:
+                a = operand_a & OOI
+                reg[a] = (reg[a] - 1) & LIM
+                pc += 3
+            elif IR == CMP:
+                a = reg[operand_a & OOI]
+                b = reg[operand_b & OOI]
+                if a == b:
+                    flag = 0b00000001
+                elif a < b:
+                    flag = 0b00000100
+                else:
+                    flag = 0b00000010
+                pc += 3
+            elif IR == JMP:
+                pc = reg[operand_a & OOI]
+            elif IR == JEQ:
+                if flag & 1:
+                    pc = reg[operand_a & OOI]
+                else:
+                    pc += 2
+            elif IR == JNE:
+                if not (flag & 1):
+                    pc = reg[operand_a & OOI]
+                else:
+                    pc += 2
+            elif IR == PUSH:
+                sp = (sp - 1) & LIM
+                ram[sp] = reg[operand_a & OOI]
+                pc += 2
+            elif IR == POP:
+                reg[operand_a & OOI] = ram[sp]
+                sp = (sp + 1) & LIM
+                pc += 2
+            elif IR == CALL:
+                sp = (sp - 1) & LIM
+                ram[sp] = (pc + 2) & LIM
+                pc = reg[operand_a & OOI]
+            elif IR == RET:
+                pc = ram[sp]
+                sp = (sp + 1) & LIM
+            else:
+                with objmode():
+                    print("Instruction not valid")
+                return pc
+
+    def run_jit(cpu):
+        """Run a CPU's loaded program through the jitted loop.
+
+        The bytearrays are wrapped in zero-copy numpy views, so all
+        writes land in the CPU's own ram/reg.
+        """
+        ram = np.frombuffer(cpu.ram, dtype=np.uint8)
+        reg = np.frombuffer(cpu.reg, dtype=np.uint8)
+        cpu.pc = int(_run(ram, reg, cpu.pc))
+        cpu.running = False
@@ -0,0 +1,13 @@
+"""Build the Cython CPU: python setup.py build_ext --inplace
+
+The compiled extension shadows cpu.py; without it the pure-Python
+modules keep working unchanged.
+"""
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="ls8",
+    ext_modules=cythonize("cpu.pyx"),
+)